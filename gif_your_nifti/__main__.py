@@ -41,6 +41,10 @@ def main():
         metavar=cfg.frameskip, default=cfg.frameskip,
         help="Will skip frames if >1 (useful for reducing GIF file size)."
         )
+    parser.add_argument(
+        '--overwrite', action='store_true', default=cfg.overwrite,
+        help="Recreate gifs even if they are newer than the input files."
+        )
 
     args = parser.parse_args()
     cfg.mode = (args.mode).lower()
@@ -48,6 +52,7 @@ def main():
     cfg.fps = args.fps
     cfg.cmap = args.cmap
     cfg.frameskip = args.frameskip
+    cfg.overwrite = args.overwrite
 
     # Welcome message
     welcome_str = '{} {}'.format('gif_your_nifti', __version__)
@@ -59,24 +64,35 @@ def main():
     print('  size = {}'.format(cfg.size))
     print('  fps  = {}'.format(cfg.fps))
     print('  frameskip  = {}'.format(cfg.frameskip))
+    print('  overwrite  = {}'.format(cfg.overwrite))
 
     # Determine gif creation mode
+    skip_str = '  skipping {} (gif is up to date, use --overwrite to recreate)'
     if cfg.mode in ['normal', 'pseudocolor', 'depth']:
         for f in args.filename:
             if cfg.mode == 'normal':
-                core.write_gif_normal(f, cfg.size, cfg.fps, cfg.frameskip)
+                written = core.write_gif_normal(
+                    f, cfg.size, cfg.fps, cfg.frameskip, cfg.overwrite)
             elif cfg.mode == 'pseudocolor':
                 print('  cmap = {}'.format(cfg.cmap))
-                core.write_gif_pseudocolor(f, cfg.size, cfg.fps, cfg.cmap, cfg.frameskip)
+                written = core.write_gif_pseudocolor(
+                    f, cfg.size, cfg.fps, cfg.cmap, cfg.frameskip,
+                    cfg.overwrite)
             elif cfg.mode == 'depth':
-                core.write_gif_depth(f, cfg.size, cfg.fps, cfg.frameskip)
+                written = core.write_gif_depth(
+                    f, cfg.size, cfg.fps, cfg.frameskip, cfg.overwrite)
+            if not written:
+                print(skip_str.format(f))
 
     elif cfg.mode == 'rgb':
         if len(args.filename) != 3:
             raise ValueError('RGB mode requires 3 input files.')
         else:
-            core.write_gif_rgb(args.filename[0], args.filename[1],
-                               args.filename[2], cfg.size, cfg.fps, cfg.frameskip)
+            written = core.write_gif_rgb(args.filename[0], args.filename[1],
+                                         args.filename[2], cfg.size, cfg.fps,
+                                         cfg.frameskip, cfg.overwrite)
+            if not written:
+                print(skip_str.format(', '.join(args.filename)))
     else:
         raise ValueError("Unrecognized mode.")
 
@@ -5,3 +5,4 @@ size = 1
 fps = 20
 cmap = 'hot'
 frameskip = 1
+overwrite = False
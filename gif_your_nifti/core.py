@@ -1,6 +1,8 @@
 """Core functions."""
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import imageio
 import nibabel as nb
 import numpy as np
@@ -10,8 +12,6 @@ except ImportError:
     import matplotlib.pyplot as plt
     get_cmap = plt.get_cmap
 from imageio import mimwrite
-from skimage.transform import resize
-from scipy.ndimage import zoom
 
 def parse_filename(filepath):
     """Parse input file path into directory, basename and extension.
@@ -33,9 +33,146 @@ def parse_filename(filepath):
     """
     path = os.path.normpath(filepath)
     dirname = os.path.dirname(path)
-    filename = path.split(os.sep)[-1]
-    basename, ext = filename.split(os.extsep, 1)
-    return dirname, basename, ext
+    basename, ext = os.path.splitext(os.path.basename(path))
+
+    # Keep double extensions of compressed files together (eg. '.nii.gz')
+    if ext == '.gz':
+        basename, inner_ext = os.path.splitext(basename)
+        ext = inner_ext + ext
+
+    return dirname, basename, ext.lstrip(os.extsep)
+
+
+def is_up_to_date(out_path, *filenames):
+    """Check whether an output file exists and is newer than its inputs.
+
+    Parameters
+    ----------
+    out_path: str
+        Output file (eg. /john/home/image.gif)
+    filenames: str
+        Input files the output was created from.
+
+    Returns
+    -------
+    up_to_date: bool
+
+    """
+    if not os.path.exists(out_path):
+        return False
+    out_mtime = os.path.getmtime(out_path)
+    return all(os.path.getmtime(f) < out_mtime for f in filenames)
+
+
+def _resample_axis(data, new_len, axis):
+    """Linearly resample data along a single axis.
+
+    Uses the same corner-aligned sampling grid as ``scipy.ndimage.zoom``.
+
+    Parameters
+    ----------
+    data: numpy array
+    new_len: int
+        Number of samples along `axis` after resampling.
+    axis: int
+
+    Returns
+    -------
+    out: numpy array
+
+    """
+    old_len = data.shape[axis]
+    if new_len == old_len:
+        return data
+
+    coords = np.linspace(0, old_len - 1, new_len)
+    lo = np.floor(coords).astype(int)
+    hi = np.minimum(lo + 1, old_len - 1)
+    shape = [1] * data.ndim
+    shape[axis] = new_len
+    dtype = np.result_type(data.dtype, np.float32)
+    weight = (coords - lo).astype(dtype).reshape(shape)
+
+    lower = np.take(data, lo, axis=axis).astype(dtype, copy=False)
+    upper = np.take(data, hi, axis=axis).astype(dtype, copy=False)
+    return lower + (upper - lower) * weight
+
+
+def _resize_linear(data, new_shape):
+    """Resize a 3D volume with linear interpolation.
+
+    Each axis is resampled with a 1D pass on the same corner-aligned grid,
+    so that all three mosaic views are sampled alike. Axes whose size does
+    not change are left untouched. Integer input is rounded back to its
+    dtype.
+
+    Parameters
+    ----------
+    data: numpy array
+    new_shape: list of int
+        Target shape of the volume.
+
+    Returns
+    -------
+    out: numpy array
+
+    """
+    dtype = data.dtype
+
+    for axis in range(3):
+        data = _resample_axis(data, new_shape[axis], axis)
+
+    if data.dtype != dtype and np.issubdtype(dtype, np.integer):
+        data = np.rint(data).astype(dtype)
+
+    return data
+
+
+def _zoom_linear(data, factors):
+    """Zoom a 3D volume with linear interpolation.
+
+    Replacement for ``scipy.ndimage.zoom(data, factors, order=1)`` built on
+    `_resize_linear`, which samples on the same corner-aligned grid as scipy.
+
+    Parameters
+    ----------
+    data: numpy array
+    factors: list of float
+        Zoom factor along each axis.
+
+    Returns
+    -------
+    out: numpy array
+
+    """
+    new_shape = [int(round(s * f)) for s, f in zip(data.shape, factors)]
+
+    return _resize_linear(data, new_shape)
+
+
+def _scale_to_uint8(data, out, vmax):
+    """Scale image values between 0-255 and cast them into a uint8 array.
+
+    Scaling and clipping are done in place, so that no other float buffer
+    is allocated. Clipping keeps negative values (eg. interpolation
+    undershoot) from wrapping around.
+
+    Parameters
+    ----------
+    data: numpy array
+        Float image data. Overwritten with the scaled values.
+    out: numpy array
+        uint8 array of the same shape as `data`.
+    vmax: float
+        Intensity that is mapped to 255.
+
+    """
+    if vmax <= 0:  # empty image, leave it black
+        out[...] = 0
+        return
+    np.multiply(data, 255.0 / vmax, out=data)
+    np.clip(data, 0, 255, out=data)
+    np.copyto(out, data, casting='unsafe')
 
 
 def load_and_prepare_image(filename, size=1):
@@ -54,26 +191,25 @@ def load_and_prepare_image(filename, size=1):
 
     """
     # Load NIfTI file
-    data = nb.load(filename).get_fdata()
+    data = nb.load(filename).get_fdata(dtype=np.float32)
 
     # Pad data array with zeros to make the shape isometric
     maximum = np.max(data.shape)
 
-    out_img = np.zeros([maximum] * 3)
+    out_img = np.zeros([maximum] * 3, dtype=np.uint8)  # uint8 for PIL
 
     a, b, c = data.shape
     x, y, z = (list(data.shape) - maximum) / -2
 
-    out_img[int(x):a + int(x),
-            int(y):b + int(y),
-            int(z):c + int(z)] = data
-
-    out_img *= 255 / out_img.max()  # scale image values between 0-255
-    out_img = out_img.astype(np.uint8)  # should be uint8 for PIL
+    # Scale image values between 0-255 while casting, before padding
+    _scale_to_uint8(data, out_img[int(x):a + int(x),
+                                  int(y):b + int(y),
+                                  int(z):c + int(z)], float(data.max()))
+    del data  # free the float buffer before resizing
 
     # Resize image by the following factor
     if size != 1:
-        out_img = resize(out_img, [int(size * maximum)] * 3)
+        out_img = _resize_linear(out_img, [int(size * maximum)] * 3)
 
     maximum = int(maximum * size)
 
@@ -83,7 +219,7 @@ def load_and_prepare_image_isotropic(filename, size=1.0, target_spacing=None):
     img = nb.load(filename)
     img = nb.as_closest_canonical(img)  # consistent RAS orientation
 
-    data = img.get_fdata()
+    data = img.get_fdata(dtype=np.float32)
     zooms = np.array(img.header.get_zooms()[:3], dtype=float)
 
     # choose an isotropic spacing to resample to
@@ -92,28 +228,82 @@ def load_and_prepare_image_isotropic(filename, size=1.0, target_spacing=None):
     factors = zooms / float(target_spacing)
 
     # resample to isotropic voxels
-    data_iso = zoom(data, factors, order=1)  # linear is fine for visualization
+    data_iso = _zoom_linear(data, factors)  # linear is fine for visualization
 
     # pad to cube then optional global resize
     maximum = int(max(data_iso.shape))
-    out_img = np.zeros((maximum, maximum, maximum), dtype=np.float32)
+    out_img = np.zeros((maximum, maximum, maximum), dtype=np.uint8)
     shape = np.array(data_iso.shape)
     start = ((maximum - shape) // 2).astype(int)
     sx, sy, sz = start
     ex, ey, ez = (start + shape).astype(int)
-    out_img[sx:ex, sy:ey, sz:ez] = data_iso
 
-    # scale to 0..255 uint8
-    out_img *= 255.0 / out_img.max()
-    out_img = out_img.astype(np.uint8)
+    # scale to 0..255 uint8 before padding, using the maximum of the unpadded
+    # data as the zero padding never raises it
+    _scale_to_uint8(data_iso, out_img[sx:ex, sy:ey, sz:ez],
+                    float(data_iso.max()))
+    del data, data_iso  # free the float buffers before resizing
 
     if size != 1.0:
-        from skimage.transform import resize
-        out_img = resize(out_img, [int(size * maximum)] * 3, order=1, preserve_range=True).astype(np.uint8)
+        out_img = _resize_linear(out_img, [int(size * maximum)] * 3)
         maximum = out_img.shape[0]
 
     return out_img, maximum
 
+def _pack_channels(out, red, green, blue):
+    """Write three frame stacks into the color channels of an RGB array.
+
+    Parameters
+    ----------
+    out: numpy array
+        Output array of shape (frames, height, width, 3).
+    red, green, blue: numpy array
+        Frame stacks of shape (frames, height, width).
+
+    """
+    out[..., 0] = red
+    out[..., 1] = green
+    out[..., 2] = blue
+
+
+def _pack_mosaic(vols, maximum, frameskip, out=None):
+    """Create the mosaic of one or several volumes as channels of one array.
+
+    The flip/transpose pattern of the three views is the same for every
+    volume, so each volume is read once and written straight into its
+    channel of the output, without intermediate copies.
+
+    Parameters
+    ----------
+    vols: tuple of numpy array
+    maximum: int
+    frameskip: int
+    out: numpy array
+        Optional output array of shape (frames, maximum, 3 * maximum,
+        len(vols)).
+
+    Returns
+    -------
+    out: numpy array
+
+    """
+    n = len(range(0, maximum, frameskip))
+    if out is None:
+        out = np.empty((n, maximum, 3 * maximum, len(vols)),
+                       dtype=vols[0].dtype)
+
+    for c, vol in enumerate(vols):
+        # Sagittal, coronal and axial views, each shaped (frames, height, width)
+        out[:, :, :maximum, c] = np.flip(
+            vol[::frameskip, :, :], 2).transpose(0, 2, 1)
+        out[:, :, maximum:2 * maximum, c] = np.flip(
+            vol[:, maximum - 1::-frameskip, :], 2).transpose(1, 2, 0)
+        out[:, :, 2 * maximum:, c] = np.flip(
+            vol[:, :, maximum - 1::-frameskip], 1).transpose(2, 1, 0)
+
+    return out
+
+
 def create_mosaic_normal(out_img, maximum, frameskip):
     """Create grayscale image.
 
@@ -128,17 +318,35 @@ def create_mosaic_normal(out_img, maximum, frameskip):
     new_img: numpy array
 
     """
-    new_img = np.array(
-        [np.hstack((
-            np.hstack((
-                np.flip(out_img[i, :, :], 1).T,
-                np.flip(out_img[:, maximum - i - 1, :], 1).T)),
-            np.flip(out_img[:, :, maximum - i - 1], 1).T))
-         for i in range(0,maximum,frameskip)])
+    new_img = _pack_mosaic((out_img,), maximum, frameskip)[..., 0]
 
     return new_img
 
 
+def iter_mosaic_normal(out_img, maximum, frameskip):
+    """Yield the grayscale mosaic one frame at a time.
+
+    Frame-by-frame equivalent of `create_mosaic_normal` that avoids holding
+    the full mosaic in memory.
+
+    Parameters
+    ----------
+    out_img: numpy array
+    maximum: int
+    frameskip: int
+
+    Yields
+    ------
+    frame: numpy array
+
+    """
+    for i in range(0, maximum, frameskip):
+        yield np.hstack((
+            np.flip(out_img[i, :, :], 1).T,
+            np.flip(out_img[:, maximum - i - 1, :], 1).T,
+            np.flip(out_img[:, :, maximum - i - 1], 1).T))
+
+
 def create_mosaic_depth(out_img, maximum, frameskip):
     """Create an image with concurrent slices represented with colors.
 
@@ -162,15 +370,12 @@ def create_mosaic_depth(out_img, maximum, frameskip):
     new_img = create_mosaic_normal(out_img, maximum, frameskip)
 
     # Create RGB image (where red and blue mean a positive or negative shift in
-    # the direction of the depicted axis)
-    rgb_img = [new_img[i:i + 3, ...] for i in range(maximum - 3)]
-
-    # Make sure to have correct data shape
-    out_img = np.rollaxis(np.array(rgb_img), 1, 4)
-
-    # Add the 3 lost images at the end
-    out_img = np.vstack(
-        (out_img, np.zeros([3] + [o for o in out_img[-1].shape]))).astype(np.uint8)
+    # the direction of the depicted axis). The 3 lost images at the end are
+    # left as zeros.
+    out_img = np.zeros(new_img.shape + (3,), dtype=new_img.dtype)
+    n = max(new_img.shape[0] - 3, 0)
+    _pack_channels(out_img[:n], new_img[:n], new_img[1:n + 1],
+                   new_img[2:n + 2])
 
     return out_img
 
@@ -189,27 +394,42 @@ def create_mosaic_RGB(out_img1, out_img2, out_img3, maximum, frameskip):
     new_img: numpy array
 
     """
-    # Load normal mosaic image
-    new_img1 = create_mosaic_normal(out_img1, maximum, frameskip)
-    new_img2 = create_mosaic_normal(out_img2, maximum, frameskip)
-    new_img3 = create_mosaic_normal(out_img3, maximum, frameskip)
-
     # Create RGB image (where red and blue mean a positive or negative shift
-    # in the direction of the depicted axis)
-    rgb_img = [[new_img1[i, ...], new_img2[i, ...], new_img3[i, ...]]
-               for i in range(maximum)]
+    # in the direction of the depicted axis), followed by 3 empty images
+    n = len(range(0, maximum, frameskip))
+    out_img = np.zeros((n + 3, maximum, 3 * maximum, 3), dtype=out_img1.dtype)
+    _pack_mosaic((out_img1, out_img2, out_img3), maximum, frameskip,
+                 out=out_img[:n])
 
-    # Make sure to have correct data shape
-    out_img = np.rollaxis(np.array(rgb_img), 1, 4)
+    return out_img
 
-    # Add the 3 lost images at the end
-    out_img = np.vstack(
-        (out_img, np.zeros([3] + [o for o in out_img[-1].shape])))
 
-    return out_img
+@lru_cache(maxsize=None)
+def colormap_lut(colormap):
+    """Quantize a matplotlib colormap into a uint8 RGB lookup table.
 
+    uint8 images can only take 256 different values, so coloring them is a
+    single gather `lut[img]`. The table is computed once per colormap.
 
-def write_gif_normal(filename, size=1, fps=18, frameskip=1):
+    Parameters
+    ----------
+    colormap: str
+        Name of the colormap.
+
+    Returns
+    -------
+    lut: numpy array
+        Lookup table of shape (256, 3).
+
+    """
+    cmap = get_cmap(colormap)
+    # Integer input indexes the colormap directly, as cmap() does for uint8
+    lut = (255 * cmap(np.arange(256))[:, :3]).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def write_gif_normal(filename, size=1, fps=18, frameskip=1, overwrite=False):
     """Procedure for writing grayscale image.
 
     Parameters
@@ -222,23 +442,34 @@ def write_gif_normal(filename, size=1, fps=18, frameskip=1):
         Frames per second
     frameskip: int
         Will skip frames if >1
+    overwrite: bool
+        If False, skip writing when the gif is newer than the input file(s).
+
+    Returns
+    -------
+    written: bool
+        False if the gif was up to date and has not been recreated.
 
     """
+    # Generate output path
+    dirname, basename, _ = parse_filename(filename)
+    out_path = os.path.join(dirname, '{}.gif'.format(basename))
+    if not overwrite and is_up_to_date(out_path, filename):
+        return False
+
     # Load NIfTI and put it in right shape
     out_img, maximum = load_and_prepare_image_isotropic(filename, size)
 
-    # Create output mosaic
-    new_img = create_mosaic_normal(out_img, maximum, frameskip)
-
-    # Figure out extension
-    ext = '.{}'.format(parse_filename(filename)[2])
+    # Create output mosaic, frame by frame
+    frames = iter_mosaic_normal(out_img, maximum, frameskip)
 
     # Write gif file
-    mimwrite_(filename.replace(ext, '.gif'), new_img,
-             format='gif', fps=int(fps * size))
+    mimwrite_(out_path, frames, format='gif', fps=int(fps * size))
+
+    return True
 
 
-def write_gif_depth(filename, size=1, fps=18, frameskip=1):
+def write_gif_depth(filename, size=1, fps=18, frameskip=1, overwrite=False):
     """Procedure for writing depth image.
 
     The image shows you in color what the value of the next slice will be. If
@@ -256,23 +487,35 @@ def write_gif_depth(filename, size=1, fps=18, frameskip=1):
         Frames per second
     frameskip: int
         Will skip frames if >1
+    overwrite: bool
+        If False, skip writing when the gif is newer than the input file(s).
+
+    Returns
+    -------
+    written: bool
+        False if the gif was up to date and has not been recreated.
 
     """
+    # Generate output path
+    dirname, basename, _ = parse_filename(filename)
+    out_path = os.path.join(dirname, '{}_depth.gif'.format(basename))
+    if not overwrite and is_up_to_date(out_path, filename):
+        return False
+
     # Load NIfTI and put it in right shape
     out_img, maximum = load_and_prepare_image_isotropic(filename, size)
 
     # Create output mosaic
     new_img = create_mosaic_depth(out_img, maximum, frameskip)
 
-    # Figure out extension
-    ext = '.{}'.format(parse_filename(filename)[2])
-
     # Write gif file
-    mimwrite_(filename.replace(ext, '_depth.gif'), new_img,
-             format='gif', fps=int(fps * size))
+    mimwrite_(out_path, new_img, format='gif', fps=int(fps * size))
 
+    return True
 
-def write_gif_rgb(filename1, filename2, filename3, size=1, fps=18, frameskip=1):
+
+def write_gif_rgb(filename1, filename2, filename3, size=1, fps=18, frameskip=1,
+                  overwrite=False):
     """Procedure for writing RGB image.
 
     Parameters
@@ -289,12 +532,31 @@ def write_gif_rgb(filename1, filename2, filename3, size=1, fps=18, frameskip=1):
         Frames per second
     frameskip: int
         Will skip frames if >1
+    overwrite: bool
+        If False, skip writing when the gif is newer than the input file(s).
+
+    Returns
+    -------
+    written: bool
+        False if the gif was up to date and has not been recreated.
 
     """
-    # Load NIfTI and put it in right shape
-    out_img1, maximum1 = load_and_prepare_image_isotropic(filename1, size)
-    out_img2, maximum2 = load_and_prepare_image_isotropic(filename2, size)
-    out_img3, maximum3 = load_and_prepare_image_isotropic(filename3, size)
+    # Generate output path
+    dirname1, basename1, _ = parse_filename(filename1)
+    basename2 = parse_filename(filename2)[1]
+    basename3 = parse_filename(filename3)[1]
+    out_filename = '{}_{}_{}_rgb.gif'.format(basename1, basename2, basename3)
+    out_path = os.path.join(dirname1, out_filename)
+    if not overwrite and is_up_to_date(out_path,
+                                       filename1, filename2, filename3):
+        return False
+
+    # Load NIfTI and put it in right shape. The three files are independent,
+    # so load them concurrently (decompression and numpy release the GIL)
+    with ThreadPoolExecutor(3) as executor:
+        (out_img1, maximum1), (out_img2, maximum2), (out_img3, maximum3) = \
+            executor.map(lambda f: load_and_prepare_image_isotropic(f, size),
+                         [filename1, filename2, filename3])
 
     if maximum1 == maximum2 and maximum1 == maximum3:
         maximum = maximum1
@@ -302,17 +564,14 @@ def write_gif_rgb(filename1, filename2, filename3, size=1, fps=18, frameskip=1):
     # Create output mosaic
     new_img = create_mosaic_RGB(out_img1, out_img2, out_img3, maximum, frameskip)
 
-    # Generate output path
-    out_filename = '{}_{}_{}_rgb.gif'.format(parse_filename(filename1)[1],
-                                             parse_filename(filename2)[1],
-                                             parse_filename(filename3)[1])
-    out_path = os.path.join(parse_filename(filename1)[0], out_filename)
-
     # Write gif file
     mimwrite_(out_path, new_img, format='gif', fps=int(fps * size))
 
+    return True
+
 
-def write_gif_pseudocolor(filename, size=1, fps=18, colormap='hot', frameskip=1):
+def write_gif_pseudocolor(filename, size=1, fps=18, colormap='hot', frameskip=1,
+                          overwrite=False):
     """Procedure for writing pseudo color image.
 
     The colormap can be any colormap from matplotlib.
@@ -329,30 +588,52 @@ def write_gif_pseudocolor(filename, size=1, fps=18, colormap='hot', frameskip=1)
         Name of the colormap that will be used.
     frameskip: int
         Will skip frames if >1
+    overwrite: bool
+        If False, skip writing when the gif is newer than the input file(s).
+
+    Returns
+    -------
+    written: bool
+        False if the gif was up to date and has not been recreated.
 
     """
+    # Generate output path
+    dirname, basename, _ = parse_filename(filename)
+    out_path = os.path.join(dirname, '{}_{}.gif'.format(basename, colormap))
+    if not overwrite and is_up_to_date(out_path, filename):
+        return False
+
     # Load NIfTI and put it in right shape
     out_img, maximum = load_and_prepare_image_isotropic(filename, size)
 
-    # Create output mosaic
-    new_img = create_mosaic_normal(out_img, maximum, frameskip)
-
     # Transform values according to the color map
-    cmap = get_cmap(colormap)
-    color_transformed = [cmap(new_img[i, ...]) for i in range(maximum)]
-    cmap_img = (255*np.delete(color_transformed, 3, 3)).astype(np.uint8)
+    lut = colormap_lut(colormap)
+
+    # Create output mosaic, frame by frame
+    cmap_img = (lut[frame]
+                for frame in iter_mosaic_normal(out_img, maximum, frameskip))
 
-    # Figure out extension
-    ext = '.{}'.format(parse_filename(filename)[2])
     # Write gif file
-    mimwrite_(filename.replace(ext, '_{}.gif'.format(colormap)),
-             cmap_img, format='gif', fps=int(fps * size))
+    mimwrite_(out_path, cmap_img, format='gif', fps=int(fps * size))
+
+    return True
 
 
 def mimwrite_(filename, img, fps=18, **kwargs):
     """Helper to provide compatibility with older/newer versions of imageio
+
+    `img` can be an array of frames or any iterable (eg. a generator) yielding
+    the frames one by one.
     """
     if tuple(map(int, imageio.__version__.split('.'))) > (2, 28):
-        return mimwrite(filename, img, duration=int(1000/fps), **kwargs)
+        kwargs['duration'] = int(1000/fps)
     else:
-        return mimwrite(filename, img, fps=fps, **kwargs)
+        kwargs['fps'] = fps
+
+    if isinstance(img, np.ndarray):
+        return mimwrite(filename, img, **kwargs)
+
+    # mimwrite only accepts sequences, so append iterables frame by frame
+    with imageio.get_writer(filename, mode='I', **kwargs) as writer:
+        for frame in img:
+            writer.append_data(frame)
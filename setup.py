@@ -17,7 +17,6 @@ setup(name='gif_your_nifti',
             'nibabel',
             'imageio<3',
             'matplotlib',
-            'scikit-image',
       ],
       keywords=['nifti', 'gif'],
       entry_points={'console_scripts': [